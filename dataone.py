@@ -1,9 +1,26 @@
+import functools
+import json
 import pickle
+import re
 import os
-import zlib
-from typing import Dict, List
+import struct
+import sys
+import warnings
+try:
+    from isal import isal_zlib as zlib  # Drop-in zlib replacements, much faster at the same ratio
+except ImportError:
+    try:
+        from zlib_ng import zlib_ng as zlib
+    except ImportError:
+        import zlib
+from typing import Callable, Dict, List
 from datetime import datetime
 
+try:
+    from compression import zstd  # Standard library from Python 3.14
+except ImportError:
+    zstd = None
+
 # Constants for data types
 INT = 1
 STRING = 2
@@ -13,30 +30,149 @@ BOOLEAN = 5
 CHAR = 6
 TEXT = 7
 
+WAL_HEADER = struct.Struct('>I')  # Length prefix of each write-ahead log entry
+
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+def compress_data(data: bytes, level: int = None) -> bytes:
+    if zstd is not None:
+        return zstd.compress(data, level=3 if level is None else level)
+    return zlib.compress(data, 1 if level is None else level)
+
+def decompress_data(data: bytes) -> bytes:
+    # Snapshots carry their own format: zstd frames start with a magic number, anything else is zlib
+    if data.startswith(ZSTD_MAGIC):
+        if zstd is None:
+            raise ValueError("Database file is zstd-compressed, which requires Python 3.14 or newer")
+        return _decompress_last_frame(zstd.ZstdDecompressor, data)
+    return _decompress_last_frame(zlib.decompressobj, data)
+
+def _decompress_last_frame(make_decompressor, data: bytes) -> bytes:
+    # Older versions appended a snapshot per store(), only the most recent one is current
+    while True:
+        decompressor = make_decompressor()
+        result = decompressor.decompress(data)
+        if not decompressor.unused_data:
+            return result
+        data = decompressor.unused_data
+
+def encode_json(obj) -> bytes:
+    return json.dumps(obj, separators=(',', ':'), default=_json_default).encode()
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot store value of type {type(value).__name__}")
+
+def decode_snapshot(data: bytes):
+    if data[:1] == b'{':
+        return json.loads(data)
+    # Snapshots written before the JSON format are pickles. Unpickling runs arbitrary code,
+    # so only open such files from a trusted source; the next store() rewrites them as JSON.
+    return pickle.loads(data)
+
+def _fsync_directory(path: str):
+    # Makes a rename inside the directory durable; directories cannot be opened on Windows
+    if os.name != 'posix':
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _to_boolean(value):
+    return value.lower() == 'true'
+
+@functools.lru_cache(maxsize=65536)
+def _to_date(value):
+    # Format YYYY-MM-DD; build the common zero-padded shape directly and leave the rest to strptime
+    if (len(value) == 10 and value[4] == value[7] == '-'
+            and value[:4].isdigit() and value[5:7].isdigit() and value[8:].isdigit()):
+        return datetime(int(value[:4]), int(value[5:7]), int(value[8:]))
+    return datetime.strptime(value, "%Y-%m-%d")
+
+def _to_char(value):
+    return value[:1]
+
+def _to_interned_str(value):
+    return sys.intern(str(value))
+
+# Converter for every data type, looked up once per column instead of once per value
+CONVERTERS = {
+    INT: int,
+    FLOAT: float,
+    BOOLEAN: _to_boolean,
+    DATE: _to_date,
+    CHAR: _to_char,
+    TEXT: str,
+    STRING: str,
+}
+
+# Python type each converter produces; CHAR is left out since a str still has to be cut to one character
+PYTHON_TYPES = {
+    INT: int,
+    FLOAT: float,
+    BOOLEAN: bool,
+    DATE: datetime,
+    TEXT: str,
+    STRING: str,
+}
+
+def schema_converters(schema: Dict[str, int], low_cardinality=()) -> Dict[str, Callable]:
+    converters = {}
+    for col_name, data_type in schema.items():
+        if data_type not in CONVERTERS:
+            raise ValueError(f"Unsupported data type: {data_type}")
+        if col_name in low_cardinality and data_type in (TEXT, STRING):
+            # Few distinct values: share one string object per value across all records
+            converters[col_name] = _to_interned_str
+        else:
+            converters[col_name] = CONVERTERS[data_type]
+    return converters
+
 def convert_value(value, data_type):
-    if data_type == INT:
-        return int(value)
-    elif data_type == FLOAT:
-        return float(value)
-    elif data_type == BOOLEAN:
-        return value.lower() == 'true'
-    elif data_type == DATE:
-        return datetime.strptime(value, "%Y-%m-%d")  # Format YYYY-MM-DD
-    elif data_type == CHAR:
-        return value[0] if len(value) > 0 else ''
-    elif data_type == TEXT or data_type == STRING:
-        return str(value)
-    else:
+    if data_type not in CONVERTERS:
         raise ValueError(f"Unsupported data type: {data_type}")
+    return CONVERTERS[data_type](value)
+
+@functools.lru_cache(maxsize=256)
+def compile_scan(columns: tuple) -> Callable:
+    # Generates a scan specialised to one set of condition columns, like a cached query plan:
+    # scan(records, v0, v1, ...) keeps the records whose columns[i] equals vi
+    params = ", ".join(f"v{i}" for i in range(len(columns)))
+    # .get reads columns missing from a record as None, like Record.__getitem__
+    checks = [f"data.get({col_name!r}) == v{i}" for i, col_name in enumerate(columns)]
+    checks[0] = f"(data := record.data).get({columns[0]!r}) == v0"  # Fetch record.data once per record
+    source = (f"def scan(records, {params}):\n"
+              f"    return [record for record in records if {' and '.join(checks)}]\n")
+    namespace = {}
+    exec(source, namespace)
+    return namespace['scan']
 
 class Record:
-    def __init__(self, data: Dict[str, any], schema: Dict[str, int]):
-        self.data = {}
-        for col_name, data_type in schema.items():
-            if col_name in data:
-                self.data[col_name] = convert_value(data[col_name], data_type)
-            else:
-                self.data[col_name] = None  # Default value if missing
+    __slots__ = ('data',)  # No per-record __dict__ next to the data dict itself
+
+    def __init__(self, data: Dict[str, any], schema: Dict[str, int], converters: Dict[str, Callable] = None):
+        if converters is None:
+            converters = schema_converters(schema)
+        # Missing columns default to None
+        self.data = {col_name: convert(data[col_name]) if col_name in data else None
+                     for col_name, convert in converters.items()}
+
+    @classmethod
+    def from_converted(cls, data: Dict[str, any]):
+        # Wraps values that are already converted and cover the whole schema
+        record = cls.__new__(cls)
+        record.data = data
+        return record
+
+    def __getstate__(self):
+        return {'data': self.data}
+
+    def __setstate__(self, state):
+        # Also the shape of a record pickled before __slots__, which pickled its __dict__
+        self.data = state['data']
 
     def __str__(self):
         return str(self.data)
@@ -48,12 +184,89 @@ class Record:
         self.data[key] = value
 
 class Table:
-    def __init__(self, name: str, schema: Dict[str, int], primary_key: str = None):
+    def __init__(self, name: str, schema: Dict[str, int], primary_key: str = None, low_cardinality=()):
         self.name = name
-        self.schema = schema
+        # Interned column names let record lookups succeed on a pointer comparison
+        self.schema = {sys.intern(col_name): data_type for col_name, data_type in schema.items()}
         self.records = {}
-        self.primary_key = primary_key
+        self.primary_key = sys.intern(primary_key) if primary_key is not None else None
         self.foreign_keys = []
+        self.indices: Dict[str, Dict[any, List[any]]] = {}
+        for col_name in low_cardinality:
+            if col_name not in self.schema:
+                raise ValueError(f"Column {col_name} not found in table {name}")
+        self.low_cardinality = frozenset(low_cardinality)
+        self.converters = schema_converters(self.schema, self.low_cardinality)
+        # An empty tuple never matches isinstance, so such keys are always converted
+        self.pk_type = PYTHON_TYPES.get(schema.get(primary_key), ())
+        self.transactions = []  # Undo logs of the open transactions, shared with the owning Database
+        self.journal = None  # Write-ahead log of the owning Database, called with every change
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Databases stored by older versions lack the newer attributes
+        self.__dict__.setdefault('indices', {})
+        self.__dict__.setdefault('transactions', [])
+        self.__dict__.setdefault('journal', None)
+        self.__dict__.setdefault('low_cardinality', frozenset())
+        if 'converters' not in state:
+            self.converters = schema_converters(self.schema)
+        if 'pk_type' not in state:
+            self.pk_type = PYTHON_TYPES.get(self.schema.get(self.primary_key), ())
+
+    def create_index(self, column: str):
+        if column not in self.schema:
+            raise ValueError(f"Column {column} not found in table {self.name}")
+        index = {}
+        for pk_value, record in self.records.items():
+            index.setdefault(record[column], []).append(pk_value)
+        self.indices[column] = index
+        self._log_change('create_index', column)
+
+    def _log_change(self, action, *args):
+        if self.journal is not None:
+            self.journal(action, self.name, *args)
+
+    def _decode_data(self, data: Dict[str, any]) -> Dict[str, any]:
+        # Turns values read back from JSON into the types the converters produce
+        for col_name, value in data.items():
+            if value is not None and col_name in self.schema:
+                if self.schema[col_name] == DATE:
+                    data[col_name] = datetime.fromisoformat(value)
+                elif self.converters[col_name] is _to_interned_str:
+                    data[col_name] = sys.intern(value)
+        return data
+
+    def _decode_key(self, key):
+        if key is not None and self.schema.get(self.primary_key) == DATE:
+            return datetime.fromisoformat(key)
+        return key
+
+    def _index_add(self, pk_value, record: Record):
+        for column, index in self.indices.items():
+            index.setdefault(record[column], []).append(pk_value)
+
+    def _index_remove(self, pk_value, record: Record):
+        for column, index in self.indices.items():
+            bucket = index[record[column]]
+            bucket.remove(pk_value)
+            if not bucket:
+                del index[record[column]]
+
+    def _log_undo(self, pk_value, previous: Record = None):
+        # Remember how to bring pk_value back to its previous state, or to absence when previous is None
+        if self.transactions:
+            self.transactions[-1].append((self._restore, (pk_value, previous)))
+
+    def _restore(self, pk_value, previous: Record = None):
+        current = self.records.get(pk_value)
+        if current is not None:
+            self._index_remove(pk_value, current)
+            if previous is None:
+                del self.records[pk_value]
+        if previous is not None:
+            self.records[pk_value] = previous  # An updated record keeps its position, a deleted one is appended
+            self._index_add(pk_value, previous)
 
     def insert(self, record: Record):
         if self.primary_key:
@@ -61,61 +274,240 @@ class Table:
             if pk_value in self.records:
                 raise ValueError(f"Primary key {pk_value} already exists")
             self.records[pk_value] = record
+            self._index_add(pk_value, record)
+            self._log_undo(pk_value)
+            self._log_change('insert', [record.data])
         else:
             raise ValueError("Cannot insert without a primary key")
 
+    def bulk_insert(self, rows: List[Dict[str, any]]):
+        if self.primary_key is None:
+            raise ValueError("Cannot insert without a primary key")
+        if not rows:
+            return
+
+        # Convert column by column so each converter is looked up once per batch
+        columns = {col_name: [convert(row[col_name]) if col_name in row else None for row in rows]
+                   for col_name, convert in self.converters.items()}
+
+        # Validate every key before inserting anything, so a failed batch leaves the table untouched
+        # Like record[self.primary_key], a primary key outside the schema reads as None
+        pk_values = columns.get(self.primary_key, [None] * len(rows))
+        new_keys = set(pk_values)
+        if len(new_keys) != len(pk_values) or not new_keys.isdisjoint(self.records):
+            seen = set()
+            for pk_value in pk_values:
+                if pk_value in seen or pk_value in self.records:
+                    raise ValueError(f"Primary key {pk_value} already exists")
+                seen.add(pk_value)
+
+        col_names = list(columns)
+        records = []
+        for pk_value, values in zip(pk_values, zip(*columns.values())):
+            record = Record.from_converted(dict(zip(col_names, values)))
+            self.records[pk_value] = record
+            self._index_add(pk_value, record)
+            self._log_undo(pk_value)
+            records.append(record.data)
+        self._log_change('insert', records)
+
     def update(self, record_id: any, updated_record: Dict[str, any]):
         if self.primary_key is None:
             raise ValueError("Cannot update without a primary key")
         
-        record_id = convert_value(record_id, self.schema[self.primary_key])
+        if not isinstance(record_id, self.pk_type):
+            record_id = self.converters[self.primary_key](record_id)
         if record_id not in self.records:
             raise ValueError(f"Record with primary key {record_id} not found")
         
-        for key, value in updated_record.items():
-            if key in self.schema:
-                self.records[record_id][key] = convert_value(value, self.schema[key])
+        # Convert everything up front so a bad value leaves the record untouched
+        changes = {key: self.converters[key](value) for key, value in updated_record.items() if key in self.schema}
+        self._apply_update(record_id, changes)
+
+    def _apply_update(self, record_id, changes: Dict[str, any]):
+        record = self.records[record_id]
+        # Changing the primary key column moves the record to its new key, so lookups by key keep working
+        new_id = changes.get(self.primary_key, record_id)
+        if new_id != record_id and new_id in self.records:
+            raise ValueError(f"Primary key {new_id} already exists")
+        if self.transactions:  # The copy is only needed to undo the change
+            self._log_undo(record_id, Record.from_converted(dict(record.data)))
+            if new_id != record_id:
+                self._log_undo(new_id)
+        self._index_remove(record_id, record)
+        record.data.update(changes)
+        if new_id != record_id:
+            del self.records[record_id]
+            self.records[new_id] = record
+        self._index_add(new_id, record)
+        self._log_change('update', record_id, changes)
 
     def delete(self, record_id: any):
         if self.primary_key is None:
             raise ValueError("Cannot delete without a primary key")
         
-        record_id = convert_value(record_id, self.schema[self.primary_key])
+        if not isinstance(record_id, self.pk_type):
+            record_id = self.converters[self.primary_key](record_id)
         if record_id not in self.records:
             raise ValueError(f"Record with primary key {record_id} not found")
         
-        del self.records[record_id]
+        record = self.records.pop(record_id)
+        self._index_remove(record_id, record)
+        self._log_undo(record_id, record)
+        self._log_change('delete', record_id)
 
     def query(self, conditions: Dict[str, any]) -> List[Record]:
-        result = []
-        for record in self.records.values():
-            if all(record[k] == v for k, v in conditions.items()):
-                result.append(record)
-        return result
-
-    def join(self, other_table, on_column):
-        result = []
-        for record in self.records.values():
-            for other_record in other_table.records.values():
-                if record[on_column] == other_record[on_column]:
-                    merged_data = {**record.data, **other_record.data}
-                    result.append(merged_data)
-        return result
+        candidates = self.records.values()
+        if self.primary_key in conditions:
+            pk_value = conditions[self.primary_key]
+            candidates = [self.records[pk_value]] if pk_value in self.records else []
+        else:
+            # Narrow the scan down to the smallest matching bucket among the indexed columns
+            buckets = [self.indices[k].get(v, ()) for k, v in conditions.items() if k in self.indices]
+            if buckets:
+                candidates = [self.records[pk_value] for pk_value in min(buckets, key=len)]
+
+        # Columns outside the schema read as None on every record
+        if any(v is not None for k, v in conditions.items() if k not in self.schema):
+            return []
+        columns = tuple(sorted(k for k in conditions if k in self.schema))
+        if not columns:
+            return list(candidates)
+
+        scan = compile_scan(columns)
+        return scan(candidates, *(conditions[k] for k in columns))
+
+    def join(self, other_table, on_column, columnar: bool = False):
+        # Hash join: build an index on the smaller side, probe it with the larger one
+        build_self = len(self.records) <= len(other_table.records)
+        build, probe = (self, other_table) if build_self else (other_table, self)
+
+        index = {}
+        for record in build.records.values():
+            index.setdefault(record[on_column], []).append(record)
+
+        # Matching records of self and other_table, pair by pair
+        left, right = [], []
+        for record in probe.records.values():
+            for match in index.get(record[on_column], ()):
+                if build_self:
+                    left.append(match.data)
+                    right.append(record.data)
+                else:
+                    left.append(record.data)
+                    right.append(match.data)
+
+        # Columns of other_table take precedence, as with a plain merge
+        if columnar:
+            # .get reads columns missing from a record as None, as the merged rows do
+            result = {col_name: [data.get(col_name) for data in left] for col_name in self.schema}
+            result.update({col_name: [data.get(col_name) for data in right] for col_name in other_table.schema})
+            return result
+        return [{**left_data, **right_data} for left_data, right_data in zip(left, right)]
+
+    def to_dict(self) -> Dict[str, any]:
+        columns = list(self.schema)
+        return {
+            'name': self.name,
+            'schema': self.schema,
+            'primary_key': self.primary_key,
+            'low_cardinality': sorted(self.low_cardinality),
+            'indices': list(self.indices),
+            # Keys are stored apart from the rows, a record's key need not equal its primary key column
+            'keys': list(self.records),
+            # Rows as value lists in schema order; DATE values are written as ISO strings
+            'rows': [list(map(record.data.get, columns)) for record in self.records.values()],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, any]):
+        table = cls(data['name'], data['schema'], data['primary_key'], data['low_cardinality'])
+        columns = list(table.schema)
+        decoders = []
+        for i, col_name in enumerate(columns):
+            if table.schema[col_name] == DATE:
+                decoders.append((i, datetime.fromisoformat))
+            elif table.converters[col_name] is _to_interned_str:
+                decoders.append((i, sys.intern))
+
+        for key, row in zip(data['keys'], data['rows']):
+            for i, decode in decoders:
+                if row[i] is not None:
+                    row[i] = decode(row[i])
+            table.records[table._decode_key(key)] = Record.from_converted(dict(zip(columns, row)))
+        for column in data['indices']:
+            table.create_index(column)
+        return table
 
     def __str__(self):
         return f"Table: {self.name}, Records: {len(self.records)}\n" + "\n".join(str(record) for record in self.records.values())
 
 class Database:
-    def __init__(self, db_name: str):
+    def __init__(self, db_name: str, compression_level: int = None, snapshot_interval: int = 100):
         self.db_name = db_name
         self.tables = {}
         self.transactions = []
-
-    def create_table(self, table_name: str, schema: Dict[str, int], primary_key: str = None):
+        self.compression_level = compression_level  # None picks a fast default for the codec in use
+        self.snapshot_interval = snapshot_interval  # Logged changes between two full snapshots
+        self.log_sequence = 0  # Sequence number of the last change applied to this database
+        self._wal = None
+        self._wal_entries = 0
+        self._replaying = False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_wal'], state['_wal_entries'], state['_replaying']  # The open log belongs to this process only
+        return state
+
+    def __setstate__(self, state):
+        # Databases stored by older versions lack the newer attributes
+        self.compression_level = None
+        self.snapshot_interval = 100
+        self.log_sequence = 0
+        self.__dict__.update(state)
+        # Transactions belong to the process that opened them; older versions even stored
+        # no-op begin_transaction() calls, which would otherwise keep every change out of the log
+        self.transactions = []
+        self._wal = None
+        self._wal_entries = 0
+        self._replaying = False
+        for table in self.tables.values():
+            table.transactions = self.transactions
+            table.journal = self._log_change
+
+    @property
+    def wal_name(self):
+        return self.db_name + '.wal'
+
+    def to_dict(self) -> Dict[str, any]:
+        return {
+            'compression_level': self.compression_level,
+            'snapshot_interval': self.snapshot_interval,
+            'log_sequence': self.log_sequence,
+            'tables': [table.to_dict() for table in self.tables.values()],
+        }
+
+    @classmethod
+    def from_dict(cls, db_name: str, data: Dict[str, any]):
+        db = cls(db_name, data['compression_level'], data['snapshot_interval'])
+        db.log_sequence = data['log_sequence']
+        for table_data in data['tables']:
+            table = Table.from_dict(table_data)
+            table.transactions = db.transactions
+            table.journal = db._log_change
+            db.tables[table.name] = table
+        return db
+
+    def create_table(self, table_name: str, schema: Dict[str, int], primary_key: str = None, low_cardinality=()):
         if table_name in self.tables:
             raise ValueError(f"Table {table_name} already exists")
-        table = Table(table_name, schema, primary_key)
+        table = Table(table_name, schema, primary_key, low_cardinality)
+        table.transactions = self.transactions
+        table.journal = self._log_change
         self.tables[table_name] = table
+        if self.transactions:
+            self.transactions[-1].append((self.tables.pop, (table_name,)))
+        self._log_change('create_table', table_name, table.schema, table.primary_key, sorted(table.low_cardinality))
 
     def get_table(self, table_name: str):
         return self.tables.get(table_name)
@@ -125,62 +517,179 @@ class Database:
 
     def commit_transaction(self):
         if self.transactions:
-            self.transactions.pop()
+            undo_log = self.transactions.pop()
+            if self.transactions:
+                # A nested commit stays undoable until the outer transaction commits
+                self.transactions[-1].extend(undo_log)
+            else:
+                self.store()  # One snapshot for the whole transaction
 
     def rollback_transaction(self):
         if self.transactions:
-            self.transactions.pop()
+            for undo, args in reversed(self.transactions.pop()):
+                undo(*args)
 
     def store(self):
-        with open(self.db_name, 'ab') as f:
-            f.seek(0, 2)  # Move cursor to the end of the file
-            data = pickle.dumps(self)
-            compressed_data = zlib.compress(data)
+        data = encode_json(self.to_dict())
+        compressed_data = compress_data(data, self.compression_level)
+        # Replace the previous snapshot atomically so a failed store never leaves a partial file behind
+        tmp_name = self.db_name + '.tmp'
+        with open(tmp_name, 'wb') as f:
             f.write(compressed_data)
+            f.flush()
+            os.fsync(f.fileno())  # The data must be on disk before the rename makes it the snapshot
+        os.replace(tmp_name, self.db_name)
+        _fsync_directory(self.db_name)
+        self._truncate_wal()  # Everything logged so far is part of the snapshot now
+
+    def close(self):
+        while self.transactions:
+            self.rollback_transaction()  # Changes of unfinished transactions are discarded
+        self.store()
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+
+    def _log_change(self, action, *args):
+        # Every change made through Database or Table lands here, whether it came from a query or the API.
+        # Inside a transaction nothing is written until commit_transaction stores a snapshot.
+        if self.transactions or self._replaying:
+            return
+        if self._wal is None:
+            self._wal = open(self.wal_name, 'ab')
+        self.log_sequence += 1
+        entry = encode_json([self.log_sequence, action, *args])
+        self._wal.write(WAL_HEADER.pack(len(entry)) + entry)
+        self._wal.flush()
+        os.fsync(self._wal.fileno())
+        self._wal_entries += 1
+        if self._wal_entries >= self.snapshot_interval:
+            self.store()
+
+    def _truncate_wal(self):
+        if self._wal is not None:
+            self._wal.truncate(0)
+        elif os.path.exists(self.wal_name):
+            os.remove(self.wal_name)
+        self._wal_entries = 0
+
+    def _replay_wal(self):
+        damaged = False
+        self._replaying = True
+        try:
+            with open(self.wal_name, 'rb') as f:
+                while True:
+                    header = f.read(WAL_HEADER.size)
+                    if not header:
+                        break
+                    try:
+                        if len(header) < WAL_HEADER.size:
+                            raise ValueError("Header cut short")
+                        size, = WAL_HEADER.unpack(header)
+                        entry = f.read(size)
+                        if len(entry) < size:
+                            raise ValueError("Entry cut short")
+                        sequence, action, *args = json.loads(entry)
+                    except (ValueError, TypeError) as e:
+                        # Torn by a crash mid-append, so never acknowledged; nothing after it can be framed
+                        warnings.warn(f"Discarded damaged end of write-ahead log {self.wal_name}: {e}")
+                        damaged = True
+                        break
+                    # Entries at or below log_sequence were already in the snapshot
+                    if sequence <= self.log_sequence:
+                        continue
+                    try:
+                        self._apply_change(action, args)
+                    except Exception as e:
+                        warnings.warn(f"Skipped write-ahead log entry {sequence}: {e}")
+                        damaged = True
+                    self.log_sequence = sequence
+                    self._wal_entries += 1
+        finally:
+            self._replaying = False
+        if damaged:
+            self.store()  # A fresh snapshot replaces the damaged log, so new entries never follow broken ones
+
+    def _apply_change(self, action, args):
+        if action == 'create_table':
+            self.create_table(*args)
+            return
+        table_name, *args = args
+        table = self.get_table(table_name)
+        if not table:
+            raise ValueError(f"Table {table_name} not found!")
+        if action == 'insert':
+            for data in args[0]:
+                table.insert(Record.from_converted(table._decode_data(data)))
+        elif action == 'update':
+            table._apply_update(table._decode_key(args[0]), table._decode_data(args[1]))
+        elif action == 'delete':
+            table.delete(table._decode_key(args[0]))
+        elif action == 'create_index':
+            table.create_index(args[0])
+        else:
+            raise ValueError(f"Unknown write-ahead log action: {action}")
 
     @staticmethod
     def load(db_name: str):
+        db = None
         if os.path.exists(db_name):
             with open(db_name, 'rb') as f:
-                f.seek(0)  # Move cursor to the beginning of the file
                 compressed_data = f.read()
-                data = zlib.decompress(compressed_data)
-                return pickle.loads(data)
-        return None
+                data = decode_snapshot(decompress_data(compressed_data))
+                db = Database.from_dict(db_name, data) if isinstance(data, dict) else data
+        if os.path.exists(db_name + '.wal'):
+            if db is None:
+                db = Database(db_name)
+            db._replay_wal()
+        return db
 
     def execute(self, query: str):
         print("-----------------------------------------------")
-        result = parse_and_execute_query(self, query)
-        self.store()  # Store the database after each query
-        return result
+        return parse_and_execute_query(self, query)  # Changes reach the write-ahead log from Table and Database
 
 def parse_and_execute_query(db, query: str):
-    tokens = query.split()
+    try:
+        tokens = _tokenize(query)
+    except ValueError as e:
+        raise ValueError(f"Invalid query: {e}")
     action = tokens[0].lower()
 
-    if action == 'build':
-        return _create_table(db, tokens[1:])
-    elif action == 'add':
-        if len(tokens) > 1 and tokens[1].lower() == 'in':
-            return _insert_record(db, tokens[2:])
-        else:
-            raise ValueError("Invalid 'add' command. Use 'add in <table_name> ...'")
-    elif action == 'change':
-        return _update_record(db, tokens[1:])
-    elif action == 'kick':
-        if tokens[1].lower() == 'out':
-            return _delete_record(db, tokens[2:])
-        else:
-            raise ValueError("Invalid 'kick' command. Use 'kick out <table_name> ...'")
-    elif action == 'mix':
-        if tokens[1].lower() == 'it' and tokens[2].lower() == 'up':
-            return _join_tables(db, tokens[3:])
-        else:
-            raise ValueError("Invalid 'mix' command. Use 'mix it up <table1> <table2> <column>'")
-    elif action == 'show':
-        return _show_table(db, tokens[1:])
-    else:
+    handler = QUERY_ACTIONS.get(action)
+    if handler is None:
         raise ValueError(f"Unknown action: {action}")
+    return handler(db, tokens[1:])
+
+# A token is a "double quoted" or 'single quoted' value, or anything else up to the next whitespace
+TOKEN_PATTERN = re.compile(r'"([^"]*)"|\'([^\']*)\'|(\S+)')
+
+def _tokenize(query: str) -> List[str]:
+    # Only values that start with a quote are unquoted, so O'Brien or C:\tmp stay as typed
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(query):
+        double_quoted, single_quoted, word = match.groups()
+        if word is None:
+            tokens.append(double_quoted if double_quoted is not None else single_quoted)
+        elif word[0] in '"\'':
+            raise ValueError(f"Unclosed quote in {word}")
+        else:
+            tokens.append(word)
+    return tokens
+
+def _add_command(db, tokens):
+    if tokens and tokens[0].lower() == 'in':
+        return _insert_record(db, tokens[1:])
+    raise ValueError("Invalid 'add' command. Use 'add in <table_name> ...'")
+
+def _kick_command(db, tokens):
+    if tokens and tokens[0].lower() == 'out':
+        return _delete_record(db, tokens[1:])
+    raise ValueError("Invalid 'kick' command. Use 'kick out <table_name> ...'")
+
+def _mix_command(db, tokens):
+    if len(tokens) >= 2 and tokens[0].lower() == 'it' and tokens[1].lower() == 'up':
+        return _join_tables(db, tokens[2:])
+    raise ValueError("Invalid 'mix' command. Use 'mix it up <table1> <table2> <column>'")
 
 def _create_table(db, tokens):
     if len(tokens) < 3:
@@ -233,31 +742,8 @@ def _insert_record(db, tokens):
     if not table:
         raise ValueError(f"Table {table_name} not found!")
     
-    record_data = {}
-    i = 1
-    while i < len(tokens):
-        if i + 1 >= len(tokens):
-            raise ValueError(f"Missing value for column {tokens[i]}")
-        
-        col_name = tokens[i]
-        value = tokens[i + 1]
-        
-        # Handle quoted strings
-        if value.startswith("'") or value.startswith('"'):
-            j = i + 2
-            while j < len(tokens) and not (tokens[j-1].endswith("'") or tokens[j-1].endswith('"')):
-                value += " " + tokens[j]
-                j += 1
-            if j == len(tokens) and not (value.endswith("'") or value.endswith('"')):
-                raise ValueError(f"Unclosed quote in value for column {col_name}")
-            value = value[1:-1]  # Remove quotes
-            i = j
-        else:
-            i += 2
-        
-        record_data[col_name] = value
-    
-    record = Record(record_data, table.schema)
+    record_data = _column_values(tokens[1:])
+    record = Record(record_data, table.schema, table.converters)
     table.insert(record)
     return f"Record added to {table_name}!"
 
@@ -271,33 +757,16 @@ def _update_record(db, tokens):
     if not table:
         raise ValueError(f"Table {table_name} not found!")
     
-    updated_data = {}
-    i = 2
-    while i < len(tokens):
-        if i + 1 >= len(tokens):
-            raise ValueError(f"Missing value for column {tokens[i]}")
-        
-        col_name = tokens[i]
-        value = tokens[i + 1]
-        
-        # Handle quoted strings
-        if value.startswith("'") or value.startswith('"'):
-            j = i + 2
-            while j < len(tokens) and not (tokens[j-1].endswith("'") or tokens[j-1].endswith('"')):
-                value += " " + tokens[j]
-                j += 1
-            if j == len(tokens) and not (value.endswith("'") or value.endswith('"')):
-                raise ValueError(f"Unclosed quote in value for column {col_name}")
-            value = value[1:-1]  # Remove quotes
-            i = j
-        else:
-            i += 2
-        
-        updated_data[col_name] = value
-    
+    updated_data = _column_values(tokens[2:])
     table.update(record_id, updated_data)
     return f"Record {record_id} updated in {table_name}!"
 
+def _column_values(tokens):
+    # Quoted values already arrive as single tokens from the tokenizer
+    if len(tokens) % 2:
+        raise ValueError(f"Missing value for column {tokens[-1]}")
+    return dict(zip(map(sys.intern, tokens[::2]), tokens[1::2]))
+
 def _delete_record(db, tokens):
     if len(tokens) != 2:
         raise ValueError("Invalid 'kick out' command. Use 'kick out <table_name> <record_id>'")
@@ -341,6 +810,16 @@ def _show_table(db, tokens):
     
     return str(table)
 
+# Handler for each query action, called with the tokens after the action word
+QUERY_ACTIONS = {
+    'build': _create_table,
+    'add': _add_command,
+    'change': _update_record,
+    'kick': _kick_command,
+    'mix': _mix_command,
+    'show': _show_table,
+}
+
 if __name__ == "__main__":
     db = Database("dataone.db")
     loaded_db = Database.load("dataone.db")
@@ -362,5 +841,6 @@ if __name__ == "__main__":
 
         query = input()
 
+    db.close()
     print("Thank you for using DataOne Database. Goodbye!")
 